@@ -1,23 +1,35 @@
 """
 This file contains all the components of the dashboard including layout,
 control filters and altair plots. 
+
+Altair and vega_datasets are only needed to render the charts, so they are
+imported on the first render rather than at startup. Set GAPEXPRESSER_PRELOAD=1
+to import them at startup instead, e.g. when gunicorn --preload shares them
+between workers. Run `python -m src.dashboard.startup` for a startup report.
 """
 
+import importlib.util
+import json
+import os
+from string import Template
+
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
-from dash.dependencies import Input, Output
-import altair as alt
+from dash.dependencies import Input, Output, State
+from flask import Response, abort, request, stream_with_context
 import dash_bootstrap_components as dbc
-import pandas as pd
-from vega_datasets import data as datasets
 
 # import controls as ctrs
 from src.dashboard import controls as ctrs
 
 
-# Read in global data
-gapminder = pd.read_csv("data/processed/gapminder_processed.csv", parse_dates=["year"])
+if os.environ.get("GAPEXPRESSER_PRELOAD") == "1":
+    import altair as alt
+    from vega_datasets import data
+
+# Global data, read once in controls
+gapminder = ctrs.gapminder
 
 # create clean country list
 country_list = gapminder[["name", "id"]].drop_duplicates()
@@ -31,6 +43,122 @@ labels = {
     "children_per_woman": "Children per Woman",
 }
 
+# Columns included in the bulk export, in addition to the statistic of interest
+export_columns = [
+    "country",
+    "name",
+    "id",
+    "year",
+    "region",
+    "sub_region",
+    "income_group",
+    "population",
+]
+
+# Number of rows encoded and sent per chunk by the export route
+EXPORT_CHUNK_ROWS = 500
+
+# Milliseconds each year is shown for in playback
+PLAYBACK_FRAME_MS = 600
+
+# Page for the year playback. The frames are embedded once and the charts are
+# animated in the browser by swapping the data of the map_frame and bar_frame
+# datasets, without calling back to the server.
+PLAYBACK_TEMPLATE = Template(
+    """<!DOCTYPE html>
+<html>
+<head>
+  <script src="https://cdn.jsdelivr.net/npm/vega@$vega_version"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-lite@$vegalite_version"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-embed@$vegaembed_version"></script>
+  <style>
+    body { font-family: sans-serif; color: DarkSlateGray; }
+    #controls { display: flex; align-items: center; gap: 12px; }
+    #year { font-size: 26px; min-width: 70px; }
+    #scrub { flex-grow: 1; }
+  </style>
+</head>
+<body>
+  <div id="controls">
+    <button id="toggle">Play</button>
+    <span id="year"></span>
+    <input id="scrub" type="range" min="0" value="0">
+  </div>
+  <div id="map"></div>
+  <div id="bar"></div>
+  <script>
+    var frames = $frames;
+    var mapSpec = $map_spec;
+    var barSpec = $bar_spec;
+    var last = frames.years.length - 1;
+    var views = {};
+    var current = 0;
+    var timer = null;
+
+    function mapRows(i) {
+      return frames.ids.map(function (id, j) {
+        return {id: id, name: frames.names[j], value: frames.map[i][j]};
+      });
+    }
+
+    function barRows(i) {
+      var bar = frames.bar[i];
+      return bar[0].map(function (country, j) {
+        return {country: country, value: bar[1][j]};
+      });
+    }
+
+    function show(i) {
+      current = i;
+      document.getElementById("year").textContent = frames.years[i];
+      document.getElementById("scrub").value = i;
+      views.map.change("map_frame", vega.changeset().remove(vega.truthy).insert(mapRows(i))).run();
+      views.bar.change("bar_frame", vega.changeset().remove(vega.truthy).insert(barRows(i))).run();
+    }
+
+    function pause() {
+      clearInterval(timer);
+      timer = null;
+      document.getElementById("toggle").textContent = "Play";
+    }
+
+    function play() {
+      if (current === last) {
+        show(0);
+      }
+      document.getElementById("toggle").textContent = "Pause";
+      timer = setInterval(function () {
+        if (current >= last) {
+          pause();
+        } else {
+          show(current + 1);
+        }
+      }, $frame_ms);
+    }
+
+    document.getElementById("scrub").max = last;
+    document.getElementById("toggle").onclick = function () {
+      timer ? pause() : play();
+    };
+    document.getElementById("scrub").oninput = function () {
+      pause();
+      show(Number(this.value));
+    };
+    Promise.all([
+      vegaEmbed("#map", mapSpec, {actions: false}),
+      vegaEmbed("#bar", barSpec, {actions: false}),
+    ]).then(function (results) {
+      views.map = results[0].view;
+      views.bar = results[1].view;
+      show(0);
+      play();
+    });
+  </script>
+</body>
+</html>
+"""
+)
+
 # Setup app and layout/frontend
 app = dash.Dash(__name__, title = "GapExpresser", external_stylesheets=[dbc.themes.BOOTSTRAP])
 server = app.server
@@ -77,6 +205,9 @@ controls = dbc.Card(
         html.Hr(),
         # filter for year
         dbc.FormGroup([html.H5("7. Show me", className="text-left"), ctrs.top_btm]),
+        html.Hr(),
+        # playback of the selected year range
+        dbc.FormGroup([html.H5("8. Playback", className="text-left"), ctrs.play]),
         html.Small(
             "* Education Ratio calculated as # of years in school men / # of years in school women. Higher values indicate larger gap between the education levels for men and women."
         ),
@@ -116,6 +247,15 @@ line = html.Iframe(
     },
 )
 
+playback = html.Iframe(
+    id="playback",
+    style={
+        "border-width": "0",
+        "width": "100%",
+        "height": "0px",
+    },
+)
+
 app.layout = dbc.Container(
     [
         html.Div(
@@ -136,6 +276,7 @@ app.layout = dbc.Container(
                     [
                         dbc.Row(world_map, align="center"),
                         dbc.Row([dbc.Col([bar], md=6), dbc.Col([line], md=6)]),
+                        dbc.Row(playback, align="center"),
                         html.Small(
                             "Note: empty plots mean that we don't have data based on your selection"
                         ),
@@ -223,6 +364,8 @@ def plot_map(stat, region, sub_region, income_grp, pop_size, year):
     > plot_map("education_ratio", "Asia", "Western Asia", "Lower middle", [10_000, 1_000_000], [1968, 2015])
     """
     #worldmap_data = data_filter(stat, region, sub_region, income_grp, year, pop_size)
+    import altair as alt
+
     alt.data_transformers.disable_max_rows()
     data = filter_data(region, sub_region, income_grp)
     data = filter_popsize(data, pop_size)
@@ -235,50 +378,19 @@ def plot_map(stat, region, sub_region, income_grp, pop_size, year):
     data[[stat]] = data[[stat]].fillna(-1) 
 
     # create world_map
-    world_map = alt.topo_feature(datasets.world_110m.url, "countries")  
+    world_map = get_world_topology()
 
     
-    # if((region is None) & (sub_region is None) &(income_grp is None)):
-    if(region is None):
-        main_map = (alt.Chart(world_map, title=f"{labels[stat]} by Country for {year[1]}")
-                .mark_geoshape(stroke="black")
-                .transform_lookup(lookup="id", from_=alt.LookupData(data, key="id", fields=["name", stat]))
-                .encode(tooltip=["name:O", stat + ":Q"], color=alt.Color(stat + ":Q", title=f"{labels[stat]}"))
-                .configure_title(fontSize=24)
-                .configure_legend(labelFontSize=12)
-                .project(type="equalEarth")
-                .properties(width=1000, height=500)
-                )
-    
-    elif(region is not None): #and sub_region is None
-        s = None
-        t = None
-        if region == "Europe":
-            s = 800
-            t = [150, 1010]
-        if region == "Asia":
-            s = 500
-            t = [-200, 500]
-        if region == "Africa":
-            s = 500
-            t = [400, 300]
-        if region == "Americas":
-            s = 300
-            t = [1000, 350]
-        if region == "Oceania":
-            s = 500
-            t = [-400, 0]
-
-
-        main_map = (alt.Chart(world_map, title=f"{labels[stat]} by Country for {year[1]}")
-                        .mark_geoshape(stroke="black")
-                        .transform_lookup(lookup="id", from_=alt.LookupData(data, key="id", fields=["name", stat]))
-                        .encode(tooltip=["name:O", stat + ":Q"], color=alt.Color(stat + ":Q", title=f"{labels[stat]}"))
-                        .configure_title(fontSize=24)
-                        .configure_legend(labelFontSize=12)
-                        .project(type='naturalEarth1', scale=s, translate=t) 
-                        .properties(width=1000, height=700))
-     
+    projection, height = get_map_projection(region)
+    main_map = (alt.Chart(world_map, title=f"{labels[stat]} by Country for {year[1]}")
+            .mark_geoshape(stroke="black")
+            .transform_lookup(lookup="id", from_=alt.LookupData(data, key="id", fields=["name", stat]))
+            .encode(tooltip=["name:O", stat + ":Q"], color=alt.Color(stat + ":Q", title=f"{labels[stat]}"))
+            .configure_title(fontSize=24)
+            .configure_legend(labelFontSize=12)
+            .project(**projection)
+            .properties(width=1000, height=height)
+            )
 
     map_chart = (
         main_map 
@@ -327,6 +439,8 @@ def plot_bar(stat, region, sub_region, income_grp, top_btm, pop_size, year):
     --------
     > plot_bar("education_ratio", "Asia", "Western Asia", "Lower middle", "Bottom",  [10_000, 1_000_000], [1968, 2015])
     """
+    import altair as alt
+
     alt.data_transformers.disable_max_rows()
 
     # filter by Region, sub-region & Income group
@@ -406,6 +520,8 @@ def plot_line(stat, region, sub_region, income_grp, top_btm, pop_size, year):
     --------
     > plot_line("education_ratio", "Asia", "Western Asia", "Lower middle", "Bottom", [10_000, 1_000_000], [1968, 2015])
     """
+    import altair as alt
+
     alt.data_transformers.disable_max_rows()
 
     # filter by Region, sub-region & Income group
@@ -455,6 +571,195 @@ def plot_line(stat, region, sub_region, income_grp, top_btm, pop_size, year):
 
 
 
+@app.callback(
+    Output("playback", "srcDoc"),
+    Output("playback", "style"),
+    Input("play", "n_clicks"),
+    State("stat", "value"),
+    State("region", "value"),
+    State("sub_region", "value"),
+    State("income_grp", "value"),
+    State("top_btm", "value"),
+    State("pop_size", "value"),
+    State("year", "value"),
+    prevent_initial_call=True,
+)
+def plot_playback(n_clicks, stat, region, sub_region, income_grp, top_btm, pop_size, year):
+    """
+    Create the year playback of the map and bar chart based on selected filters
+
+    All frames for the year range are sent in one response and played back in
+    the browser, so stepping through the years doesn't call the server again.
+
+    Parameters
+    --------
+    n_clicks: int
+        Number of clicks on the Play button
+    stat: string
+        Selection from statistic of interest filter
+    region: string
+        Selection from the Region filter
+    sub_region: sting
+        Selection from Sub Region filter
+    income_grp: string
+        Selection from Income Group filter
+    top_btm: string
+        Selection from Top/Bottom filter
+    pop_size: integer
+        Population size for which the data is displayed, from Population Size filter
+    year: integer
+        Year range to play back, from Year filter
+
+    Returns
+    --------
+    playback
+        page animating the map and top 5 or bottom 5 bar chart over the year range
+    style
+        style of the playback frame, expanded to show the page
+
+    Example
+    --------
+    > plot_playback(1, "education_ratio", "Asia", None, None, "Bottom", [10_000, 1_000_000], [1968, 2015])
+    """
+    import altair as alt
+
+    # filter by Region, sub-region & Income group
+    data = filter_data(region, sub_region, income_grp)
+
+    # filter on pop_size
+    data = filter_popsize(data, pop_size)
+
+    # keep the colours and bar lengths comparable across years
+    frames = get_frames(data, stat, top_btm, year)
+    low, high = frames.pop("domain")
+    projection, height = get_map_projection(region)
+
+    main_map = (
+        alt.Chart(get_world_topology(), title=f"{labels[stat]} by Country")
+        .mark_geoshape(stroke="black", invalid=None)
+        .transform_lookup(
+            lookup="id",
+            from_=alt.LookupData(
+                alt.NamedData(name="map_frame"), key="id", fields=["name", "value"]
+            ),
+        )
+        .encode(
+            tooltip=["name:N", alt.Tooltip("value:Q", title=labels[stat])],
+            color=alt.condition(
+                "isValid(datum.value)",
+                alt.Color("value:Q", title=labels[stat], scale=alt.Scale(domain=[low, high])),
+                alt.value("lightgray"),
+            ),
+        )
+        .configure_title(fontSize=24)
+        .configure_legend(labelFontSize=12)
+        .project(**projection)
+        .properties(width=1000, height=height)
+    )
+
+    bar = (
+        alt.Chart(
+            alt.NamedData(name="bar_frame"),
+            title=f"{labels[stat]} - {top_btm} 5 Countries",
+        )
+        .mark_bar()
+        .encode(
+            y=alt.Y("country:N", sort="-x", title="Country"),
+            x=alt.X(
+                "value:Q",
+                title=labels[stat],
+                scale=alt.Scale(domain=[min(0, low), high]),
+            ),
+            color=alt.Color("country:N", legend=None),
+            tooltip=["country:N", alt.Tooltip("value:Q", title=labels[stat])],
+        )
+        .configure_axis(labelFontSize=12, titleFontSize=14)
+        .configure_title(fontSize=15)
+        .properties(width=800, height=200)
+    )
+
+    playback = PLAYBACK_TEMPLATE.substitute(
+        vega_version=alt.VEGA_VERSION,
+        vegalite_version=alt.VEGALITE_VERSION,
+        vegaembed_version=alt.VEGAEMBED_VERSION,
+        frames=json.dumps(frames).replace("</", "<\\/"),
+        map_spec=main_map.to_json().replace("</", "<\\/"),
+        bar_spec=bar.to_json().replace("</", "<\\/"),
+        frame_ms=PLAYBACK_FRAME_MS,
+    )
+    style = {
+        "border-width": "0",
+        "width": "100%",
+        "height": f"{height + 450}px",
+    }
+    return playback, style
+
+
+def get_map_projection(region):
+    """
+    Select the map projection, zoomed in on the selected region
+
+    Parameters
+    --------
+    region: string
+        Selection from the Region filter
+
+    Returns
+    --------
+    projection
+        dictionary of arguments for the chart projection
+    height
+        height of the map in pixels
+
+    Example
+    --------
+    > get_map_projection("Asia")
+    """
+    if region is None:
+        return {"type": "equalEarth"}, 500
+
+    s = None
+    t = None
+    if region == "Europe":
+        s = 800
+        t = [150, 1010]
+    if region == "Asia":
+        s = 500
+        t = [-200, 500]
+    if region == "Africa":
+        s = 500
+        t = [400, 300]
+    if region == "Americas":
+        s = 300
+        t = [1000, 350]
+    if region == "Oceania":
+        s = 500
+        t = [-400, 0]
+    return {"type": "naturalEarth1", "scale": s, "translate": t}, 700
+
+
+def get_world_topology():
+    """
+    Load the world country shapes used by the map
+
+    vega_datasets is only imported here, as it is needed for nothing but the
+    topology URL.
+
+    Returns
+    --------
+    topology
+        altair topo feature with the country shapes
+
+    Example
+    --------
+    > get_world_topology()
+    """
+    import altair as alt
+    from vega_datasets import data as datasets
+
+    return alt.topo_feature(datasets.world_110m.url, "countries")
+
+
 def get_topbtm_data(data, stat, top_btm, year):
     """
     Filter data based on top 5 or bottom 5 countries selection
@@ -498,6 +803,69 @@ def get_topbtm_data(data, stat, top_btm, year):
     return data
 
 
+def get_frames(data, stat, top_btm, year):
+    """
+    Compute the playback frames for every year in the year range
+
+    Parameters
+    --------
+    data: pandas dataframe
+        Data filtered on region, sub region, income group and population size
+    stat: string
+        Selection from statistic of interest filter
+    top_btm: string
+        Selection from Top/Bottom filter
+    year: integer
+        Year range to compute frames for, from Year filter
+
+    Returns
+    --------
+    frames
+        dictionary with the `years` of the range, the country `ids` and `names`
+        on the map, per-year `map` vectors of values aligned with `ids`, per-year
+        `bar` pairs of the top 5 or bottom 5 countries and their values, and the
+        value `domain` across all frames
+
+    Example
+    --------
+    > get_frames(data, "education_ratio", "Bottom", [1968, 2015])
+    """
+    years = list(range(year[0], year[1] + 1))
+    data = data[(data["year"] >= f"{year[0]}") & (data["year"] <= f"{year[1]}")]
+    data = data.assign(year=data["year"].dt.year).dropna(subset=[stat])
+
+    # one row per year, one column per country on the map, keyed by name as
+    # some countries share an id. pivot raises on duplicate entries.
+    countries = country_list.dropna(subset=["id"])
+    map_frames = data.pivot(index="year", columns="name", values=stat).reindex(
+        index=years, columns=countries["name"]
+    )
+
+    # top 5 or bottom 5 countries of each year
+    ranked = (
+        data.sort_values(["year", stat], ascending=[True, top_btm != "Top"])
+        .groupby("year")
+        .head()
+        .groupby("year")
+        .agg(country=("country", list), value=(stat, list))
+        .reindex(years)
+    )
+
+    return {
+        "years": years,
+        "ids": countries["id"].astype(int).tolist(),
+        "names": countries["name"].tolist(),
+        "map": json.loads(map_frames.round(4).to_json(orient="values")),
+        "bar": [
+            [country, value] if isinstance(country, list) else [[], []]
+            for country, value in zip(ranked["country"], ranked["value"])
+        ],
+        "domain": [float(data[stat].min()), float(data[stat].max())]
+        if not data.empty
+        else [0, 1],
+    }
+
+
 def filter_data(region, sub_region, income_grp):
     """
     Filter data based on region, sub region and income group selection
@@ -582,5 +950,207 @@ def filter_popsize(data, pop_size):
     return data
 
 
+@server.route("/export")
+def export_data():
+    """
+    Stream the data behind the current view as CSV, NDJSON or Arrow IPC
+
+    Takes the same filters as the chart callbacks as query parameters, with
+    `pop_size` and `year` given as comma separated ranges. `top_btm` is
+    optional; when it is left out every country matching the filters is
+    exported. The response is written in chunks of EXPORT_CHUNK_ROWS rows so
+    memory use does not grow with the size of the export.
+
+    Returns
+    --------
+    response
+        chunked response with the filtered data in the requested format
+
+    Example
+    --------
+    > GET /export?stat=life_expectancy&region=Asia&year=1968,2015&format=csv
+    """
+    args = request.args
+    stat = args.get("stat", "education_ratio")
+    if stat not in labels:
+        abort(400, f"Unknown statistic: {stat}")
+    fmt = args.get("format", "csv")
+    if fmt not in export_writers:
+        abort(400, f"Unknown export format: {fmt}")
+    if fmt == "arrow" and importlib.util.find_spec("pyarrow") is None:
+        abort(501, "Arrow export requires pyarrow to be installed")
+
+    try:
+        pop_size = get_range(args.get("pop_size"), [10_000, 1_500_000_000])
+        year = get_range(args.get("year"), [1968, 2015])
+    except (ValueError, OverflowError):
+        abort(400, "pop_size and year must be two comma separated integers")
+
+    data = filter_data(args.get("region"), args.get("sub_region"), args.get("income_grp"))
+    data = filter_popsize(data, pop_size)
+    top_btm = args.get("top_btm")
+    if top_btm is not None:
+        data = get_topbtm_data(data, stat, top_btm, year)
+    data = data[(data["year"] >= f"{year[0]}") & (data["year"] <= f"{year[1]}")]
+    data = data[export_columns + [stat]]
+
+    mimetype, extension, writer = export_writers[fmt]
+    return Response(
+        stream_with_context(writer(data)),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename=gapminder_{stat}.{extension}"
+        },
+    )
+
+
+def get_range(value, default):
+    """
+    Parse a comma separated range query parameter
+
+    Parameters
+    --------
+    value: string
+        Query parameter value, e.g. "1968,2015", or None
+    default: list
+        Range returned when the parameter is not given
+
+    Returns
+    --------
+    list
+        lower and upper bound of the range as integers
+
+    Example
+    --------
+    > get_range("1968,2015", [1968, 2015])
+    """
+    if value is None:
+        return default
+    bounds = [int(float(v)) for v in value.split(",")]
+    if len(bounds) != 2:
+        raise ValueError(f"Expected two values, got {value}")
+    return bounds
+
+
+def iter_chunks(data):
+    """
+    Yield consecutive row chunks of the export data
+
+    Parameters
+    --------
+    data: pandas dataframe
+        Data to be exported
+
+    Returns
+    --------
+    generator
+        chunks of at most EXPORT_CHUNK_ROWS rows, with year as an integer.
+        Empty data still yields a single empty chunk.
+
+    Example
+    --------
+    > next(iter_chunks(data))
+    """
+    for start in range(0, max(len(data), 1), EXPORT_CHUNK_ROWS):
+        chunk = data.iloc[start : start + EXPORT_CHUNK_ROWS]
+        yield chunk.assign(year=chunk["year"].dt.year)
+
+
+def write_csv(data):
+    """
+    Encode the export data as CSV, one chunk at a time
+
+    Parameters
+    --------
+    data: pandas dataframe
+        Data to be exported
+
+    Returns
+    --------
+    generator
+        CSV text, starting with the header row
+
+    Example
+    --------
+    > "".join(write_csv(data))
+    """
+    yield ",".join(data.columns) + "\n"
+    for chunk in iter_chunks(data):
+        yield chunk.to_csv(header=False, index=False)
+
+
+def write_ndjson(data):
+    """
+    Encode the export data as newline delimited JSON, one chunk at a time
+
+    Parameters
+    --------
+    data: pandas dataframe
+        Data to be exported
+
+    Returns
+    --------
+    generator
+        JSON lines, one record per row
+
+    Example
+    --------
+    > "".join(write_ndjson(data))
+    """
+    for chunk in iter_chunks(data):
+        if chunk.empty:
+            continue
+        yield chunk.to_json(orient="records", lines=True).rstrip("\n") + "\n"
+
+
+def write_arrow(data):
+    """
+    Encode the export data as an Arrow IPC stream, one record batch per chunk
+
+    pyarrow is an optional dependency and is only imported when an Arrow
+    export is requested.
+
+    Parameters
+    --------
+    data: pandas dataframe
+        Data to be exported
+
+    Returns
+    --------
+    generator
+        Arrow IPC stream messages: schema, record batches and end-of-stream marker
+
+    Example
+    --------
+    > b"".join(write_arrow(data))
+    """
+    import pyarrow as pa
+
+    schema = None
+    for chunk in iter_chunks(data):
+        if schema is None:
+            # columns that are all missing in the first chunk are text columns
+            inferred = pa.Schema.from_pandas(chunk, preserve_index=False)
+            schema = pa.schema(
+                [
+                    f.with_type(pa.string()) if pa.types.is_null(f.type) else f
+                    for f in inferred
+                ]
+            )
+            yield schema.serialize().to_pybytes()
+        batch = pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False)
+        yield batch.serialize().to_pybytes()
+    # end-of-stream marker: continuation token followed by a zero length
+    yield b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+# Mime type, file extension and writer for each export format
+export_writers = {
+    "csv": ("text/csv", "csv", write_csv),
+    "ndjson": ("application/x-ndjson", "ndjson", write_ndjson),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow", write_arrow),
+}
+
+
 if __name__ == "__main__":
     app.run_server()
\ No newline at end of file
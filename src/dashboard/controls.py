@@ -9,8 +9,8 @@ import dash_bootstrap_components as dbc
 import pandas as pd
 
 
-# Read in global data
-gapminder = pd.read_csv("data/processed/gapminder_processed.csv")
+# Read in global data, shared with app
+gapminder = pd.read_csv("data/processed/gapminder_processed.csv", parse_dates=["year"])
 
 
 txt_stl = {
@@ -112,4 +112,12 @@ top_btm = dcc.RadioItems(
     ],
     value="Bottom",
     labelStyle={"display": "block"},
-)
\ No newline at end of file
+)
+
+
+play = dbc.Button(
+    "Play years",
+    id="play",
+    color="light",
+    block=True,
+)
@@ -0,0 +1,286 @@
+"""
+This file contains the startup report for the dashboard: the slowest imports
+pulled in by `src.dashboard.app` (as reported by `python -X importtime`) and the
+time from a cold process start to the first response and first chart render.
+
+Run from the root of this repository:
+    python -m src.dashboard.startup
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+# Targets for a cold process to serve its first response and render its first
+# charts, in seconds: 20% over the slowest median measured with deferred imports
+# (0.663 s and 0.999 s). The README lists the measurements and the baseline.
+FIRST_RESPONSE_TARGET_SECONDS = 0.8
+FIRST_RENDER_TARGET_SECONDS = 1.2
+
+# Inputs of the plot_map and plot_bar callbacks, in the order they are declared
+MAP_INPUTS = ["stat", "region", "sub_region", "income_grp", "pop_size", "year"]
+BAR_INPUTS = ["stat", "region", "sub_region", "income_grp", "top_btm", "pop_size", "year"]
+
+# Run in a fresh interpreter, which reads its wall clock start time from the
+# STARTUP_REPORT_START environment variable
+FIRST_RESPONSE_SCRIPT = """
+import json, os
+from src.dashboard.startup import time_first_responses
+print(json.dumps(time_first_responses(float(os.environ["STARTUP_REPORT_START"]))))
+"""
+
+
+def get_import_times(module="src.dashboard.app"):
+    """
+    Time every import pulled in by a module using `python -X importtime`
+
+    Parameters
+    --------
+    module: string
+        Module to import in a fresh interpreter
+
+    Returns
+    --------
+    imports
+        list of (package, self time, cumulative time, nesting level), with
+        times in seconds, in the order reported by the interpreter. Imports
+        are listed before the module that made them, one level deeper
+
+    Example
+    --------
+    > get_import_times("src.dashboard.app")
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, package = line[len("import time:") :].split("|")
+        # one separating space, then two spaces per nesting level
+        level = (len(package) - len(package.lstrip()) - 1) // 2
+        imports.append(
+            (package.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, level)
+        )
+    return imports
+
+
+def get_chart_request(output, inputs):
+    """
+    Build the callback request a browser sends to render a chart
+
+    Parameters
+    --------
+    output: string
+        Id of the chart to render
+    inputs: list
+        Ids of the controls the chart callback takes, in order
+
+    Returns
+    --------
+    request
+        body for POST /_dash-update-component, using the default control values
+
+    Example
+    --------
+    > get_chart_request("world_map", MAP_INPUTS)
+    """
+    from src.dashboard import controls as ctrs
+
+    return {
+        "output": f"{output}.srcDoc",
+        "outputs": {"id": output, "property": "srcDoc"},
+        "inputs": [
+            {"id": ctrl, "property": "value", "value": getattr(ctrs, ctrl).value}
+            for ctrl in inputs
+        ],
+        "changedPropIds": [],
+        "state": [],
+    }
+
+
+def time_first_responses(start):
+    """
+    Time a cold start of the app up to its first responses and chart renders
+
+    Meant to be called in a fresh interpreter, see FIRST_RESPONSE_SCRIPT.
+
+    Parameters
+    --------
+    start: float
+        Wall clock time the interpreter was started at, from time.time()
+
+    Returns
+    --------
+    times
+        dictionary of seconds from start to importing the app (`import_app`),
+        serving the index page (`first_response`), serving the layout
+        (`first_layout`), rendering the map (`first_map`) and rendering the
+        bar chart (`first_render`)
+
+    Example
+    --------
+    > time_first_responses(time.time())
+    """
+    from src.dashboard.app import server
+
+    times = {"import_app": time.time() - start}
+    client = server.test_client()
+    requests = [
+        ("first_response", lambda: client.get("/")),
+        ("first_layout", lambda: client.get("/_dash-layout")),
+        (
+            "first_map",
+            lambda: client.post(
+                "/_dash-update-component",
+                json=get_chart_request("world_map", MAP_INPUTS),
+            ),
+        ),
+        (
+            "first_render",
+            lambda: client.post(
+                "/_dash-update-component", json=get_chart_request("bar", BAR_INPUTS)
+            ),
+        ),
+    ]
+    for name, send in requests:
+        response = send()
+        if response.status_code != 200:
+            raise RuntimeError(f"{name} failed with status {response.status_code}")
+        times[name] = time.time() - start
+    return times
+
+
+def get_first_response_times(runs=5):
+    """
+    Time cold starts of the app up to its first responses and chart renders
+
+    Parameters
+    --------
+    runs: int
+        Number of fresh interpreters to time
+
+    Returns
+    --------
+    times
+        dictionary of the median seconds over all runs for each step timed by
+        time_first_responses
+
+    Example
+    --------
+    > get_first_response_times(runs=5)
+    """
+    results = []
+    for _ in range(runs):
+        env = dict(os.environ, STARTUP_REPORT_START=repr(time.time()))
+        result = subprocess.run(
+            [sys.executable, "-c", FIRST_RESPONSE_SCRIPT],
+            capture_output=True,
+            text=True,
+            check=True,
+            env=env,
+        )
+        results.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {name: statistics.median(r[name] for r in results) for name in results[0]}
+
+
+def print_report(
+    top=15,
+    runs=5,
+    response_target=FIRST_RESPONSE_TARGET_SECONDS,
+    render_target=FIRST_RENDER_TARGET_SECONDS,
+):
+    """
+    Print the startup report and check the times to first response and render
+
+    Parameters
+    --------
+    top: int
+        Number of top level imports to list
+    runs: int
+        Number of cold starts to take the median time of
+    response_target: float
+        Target time to first response in seconds
+    render_target: float
+        Target time to render the first map and bar chart in seconds
+
+    Returns
+    --------
+    bool
+        True if both the first response and the first render met their target
+
+    Example
+    --------
+    > print_report(top=10, runs=5)
+    """
+    imports = get_import_times()
+    # the app's own imports are listed just before it, one level deeper
+    index = max(i for i, imp in enumerate(imports) if imp[0] == "src.dashboard.app")
+    level = imports[index][3]
+    direct = []
+    for imp in reversed(imports[:index]):
+        if imp[3] <= level:
+            break
+        if imp[3] == level + 1:
+            direct.append(imp)
+    top_level = sorted(direct, key=lambda imp: imp[2], reverse=True)
+    print(f"Slowest imports of src.dashboard.app (top {top}):")
+    print(f"{'cumulative [s]':>15} {'self [s]':>10}  package")
+    for package, self_s, cumulative_s, _ in top_level[:top]:
+        print(f"{cumulative_s:>15.3f} {self_s:>10.3f}  {package}")
+
+    times = get_first_response_times(runs)
+    print()
+    print(f"Time from process start (median of {runs} runs):")
+    print(f"  import app      {times['import_app']:.3f} s")
+    print(f"  first response  {times['first_response']:.3f} s")
+    print(f"  first layout    {times['first_layout']:.3f} s")
+    print(f"  first map       {times['first_map']:.3f} s")
+    print(f"  first render    {times['first_render']:.3f} s")
+
+    within_target = True
+    for name, label, target in [
+        ("first_response", "first response", response_target),
+        ("first_render", "first render", render_target),
+    ]:
+        ok = times[name] <= target
+        within_target = within_target and ok
+        status = "OK" if ok else "OVER TARGET"
+        print(f"Target time to {label}: {target:.3f} s ({status})")
+    return within_target
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup report for the dashboard")
+    parser.add_argument(
+        "--top", type=int, default=15, help="number of top level imports to list"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="number of cold starts to time"
+    )
+    parser.add_argument(
+        "--response-target",
+        type=float,
+        default=FIRST_RESPONSE_TARGET_SECONDS,
+        help="target time to first response in seconds",
+    )
+    parser.add_argument(
+        "--render-target",
+        type=float,
+        default=FIRST_RENDER_TARGET_SECONDS,
+        help="target time to render the first map and bar chart in seconds",
+    )
+    args = parser.parse_args()
+    within_target = print_report(
+        args.top, args.runs, args.response_target, args.render_target
+    )
+    sys.exit(0 if within_target else 1)